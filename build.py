@@ -4,33 +4,56 @@ build.py
 
 A professional build script that automates:
   - Building a Go shared library.
-  - Generating a DEF file from the DLL exports.
+  - Generating a DEF file from the DLL exports (via pefile if installed,
+    otherwise dumpbin).
   - Generating an import LIB file via dlltool.
-  - Copying the DLL to the main target directory as well as test directories.
+  - Copying the DLL to the main target directory as well as test directories
+    (concurrently).
   - Building a Rust project with Cargo.
   - Optionally cleaning generated artifacts.
 
+The build steps can also be driven in-process from another Python script:
+    from build import build_all
+    build_all()
+
 Usage:
-    Build all targets:
+    Build all targets (skipping up-to-date steps):
         python build.py
+    Rebuild all targets unconditionally:
+        python build.py --force
     Clean build artifacts:
         python build.py --clean
 """
 
 import argparse
+import functools
 import logging
+import os
+import re
 import shutil
 import subprocess
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator, List
+
+try:
+    import pefile
+except ImportError:  # Optional: fall back to dumpbin when pefile is unavailable.
+    pefile = None
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s] %(levelname)s: %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+    # use_last_error makes ctypes save GetLastError() right after each call,
+    # before other copy threads can overwrite it.
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _kernel32.CopyFileW.argtypes = (wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.BOOL)
+    _kernel32.CopyFileW.restype = wintypes.BOOL
+
+log = logging.getLogger(__name__)
 
 # Constants and Paths
 FFI_DIR = Path("go_lib")
@@ -41,32 +64,101 @@ EXPORT_DEF = FFI_DIR / f"{EXPORT_NAME}.def"
 EXPORT_LIB = FFI_DIR / f"{EXPORT_NAME}.lib"
 EXPORT_HEADER = FFI_DIR / f"{EXPORT_NAME}.h"
 
+# Suffixes of generated files under FFI_DIR that clean() removes.
+GENERATED_SUFFIXES = {".dll", ".def", ".lib", ".tmp"}
+
 TARGET_DIR = Path("target") / "debug"
-TARGET_DLL = TARGET_DIR / f"{EXPORT_NAME}.dll"
+
+# Repo-local Go build cache, reused across builds and CI runs.
+GO_CACHE_DIR = Path(".gocache")
 
 # Test directories where the DLL should also be copied.
 TEST_DIRS = [Path("target/debug/deps"), Path("target/debug")]
 
+# ERROR_SHARING_VIOLATION and ERROR_LOCK_VIOLATION: the file is briefly held
+# by another process (typically an antivirus scan) and a retry may succeed.
+_SHARING_ERRORS = (32, 33)
 
-def run_command(cmd, *, cwd=None, capture_output=False, shell=False):
+# dumpbin /exports row: ordinal, hex hint, hex RVA, name. Matched on raw bytes.
+# Requiring hex in the hint/RVA columns keeps header rows such as
+# "25 number of functions" from matching.
+_DEF_RE = re.compile(rb"^\s*\d+\s+[0-9A-Fa-f]+\s+[0-9A-Fa-f]+\s+(\S+)")
+
+
+def log_command(cmd):
+    """
+    Log a command line, formatting it only if INFO records are emitted.
+    """
+    if log.isEnabledFor(logging.INFO):
+        log.info(
+            "Running command: %s",
+            cmd if isinstance(cmd, str) else subprocess.list2cmdline(cmd),
+        )
+
+
+def run_command(cmd, *, cwd=None, capture_output=False, shell=False, env=None):
     """
     Helper to run a command and return the result.
     Raises CalledProcessError if the command fails.
     """
-    logging.info("Running command: %s", " ".join(cmd) if isinstance(cmd, list) else cmd)
+    log_command(cmd)
     result = subprocess.run(
-        cmd, cwd=cwd, capture_output=capture_output, text=True, shell=shell, check=True
+        cmd,
+        cwd=cwd,
+        capture_output=capture_output,
+        text=True,
+        shell=shell,
+        env=env,
+        check=True,
     )
     return result
 
 
+@functools.lru_cache(maxsize=None)
+def tool(name: str) -> str:
+    """
+    Resolve an external tool to its absolute path, once per run.
+    Passing the absolute path spares the OS a PATH search on every spawn.
+    Exits with an error if the tool is not on PATH.
+    """
+    path = shutil.which(name)
+    if path is None:
+        log.error("Required tool not found on PATH: %s", name)
+        sys.exit(1)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def go_env():
+    """
+    Environment for Go commands, resolved once per run.
+    GOCACHE defaults to GO_CACHE_DIR (an explicit GOCACHE is respected),
+    -trimpath is appended to GOFLAGS and cgo is enabled for c-shared builds.
+    """
+    env = dict(os.environ)
+    env.setdefault("GOCACHE", str(GO_CACHE_DIR.absolute()))
+    env["GOFLAGS"] = " ".join(filter(None, (env.get("GOFLAGS"), "-trimpath")))
+    env["CGO_ENABLED"] = "1"
+    return env
+
+
+def needs_rebuild(target: Path, *deps: Path) -> bool:
+    """
+    Return True if target is missing or older than any of its dependencies.
+    A missing dependency also counts as stale, so the step runs and reports
+    the problem itself.
+    """
+    try:
+        target_mtime = target.stat().st_mtime_ns
+        return any(dep.stat().st_mtime_ns > target_mtime for dep in deps)
+    except FileNotFoundError:
+        return True
+
+
 def ensure_dirs():
     """Ensure the FFI directory exists."""
-    if not FFI_DIR.exists():
-        logging.info("Creating directory: %s", FFI_DIR)
-        FFI_DIR.mkdir(parents=True, exist_ok=True)
-    else:
-        logging.info("Directory already exists: %s", FFI_DIR)
+    FFI_DIR.mkdir(parents=True, exist_ok=True)
+    log.info("Using FFI directory: %s", FFI_DIR)
 
 
 def go_mod_init():
@@ -76,14 +168,16 @@ def go_mod_init():
     """
     go_mod = FFI_DIR / "go.mod"
     if go_mod.exists():
-        logging.info("Go module already initialized (%s exists)", go_mod)
+        log.info("Go module already initialized (%s exists)", go_mod)
         return
 
     try:
-        logging.info("Initializing Go module...")
-        run_command(["go", "mod", "init", "whatsmeow-ffi"], cwd=str(FFI_DIR))
+        log.info("Initializing Go module...")
+        run_command(
+            (tool("go"), "mod", "init", "whatsmeow-ffi"), cwd=FFI_DIR, env=go_env()
+        )
     except subprocess.CalledProcessError as e:
-        logging.error("Failed to initialize Go module: %s", e)
+        log.error("Failed to initialize Go module: %s", e)
         sys.exit(1)
 
 
@@ -93,71 +187,141 @@ def go_build():
     This command is executed from within FFI_DIR so that the output DLL
     does not include extra path components.
     """
-    logging.info("Building Go shared library...")
+    log.info("Building Go shared library...")
     try:
         # Run in FFI_DIR so that output file is just "go_lib.dll"
         run_command(
-            [
-                "go",
+            (
+                tool("go"),
                 "build",
                 "-buildmode=c-shared",
                 "-o",
                 f"{EXPORT_NAME}.dll",
                 f"{EXPORT_NAME}.go",
-            ],
-            cwd=str(FFI_DIR),
+            ),
+            cwd=FFI_DIR,
+            env=go_env(),
         )
     except subprocess.CalledProcessError as e:
-        logging.error("Go build failed: %s", e)
+        log.error("Go build failed: %s", e)
         sys.exit(1)
 
     if not EXPORT_DLL.exists():
-        logging.error("Expected DLL not found: %s", EXPORT_DLL)
+        log.error("Expected DLL not found: %s", EXPORT_DLL)
         sys.exit(1)
     else:
-        logging.info("DLL built: %s", EXPORT_DLL)
+        log.info("DLL built: %s", EXPORT_DLL)
 
 
-def generate_def_content(dumpbin_output: str) -> str:
+def parse_dumpbin_exports(dumpbin_lines: Iterable[bytes]) -> Iterator[str]:
     """
-    Process dumpbin output to generate DEF file content.
-    Lines that start with a digit and have at least 4 columns are parsed,
-    and the 4th token (the symbol name) is extracted.
+    Extract exported symbol names from raw dumpbin /exports output.
+    Lines that start with an ordinal and have at least 4 columns are
+    matched by _DEF_RE, and the 4th token (the symbol name) is yielded.
+    Only the matched names are decoded; they must be ASCII, and anything
+    else raises UnicodeDecodeError rather than producing a mangled DEF.
+    The lines may come from any iterable, so dumpbin's stdout can be
+    consumed as it is produced.
     """
-    lines = dumpbin_output.splitlines()
-    def_lines = ["EXPORTS"]
-    for line in lines:
-        parts = line.split()
-        if len(parts) > 3 and parts[0].isdigit():
-            def_lines.append(parts[3])
-    return "\n".join(def_lines)
+    for match in map(_DEF_RE.match, dumpbin_lines):
+        if match:
+            yield match.group(1).decode("ascii")
 
 
-def generate_def():
+def read_exports_pefile(dll: Path) -> List[str]:
     """
-    Generate a DEF file from the DLL exports using dumpbin.
-    Note: Since we're running in FFI_DIR, we pass only the DLL's name.
+    Read the exported symbol names directly from the DLL using pefile.
+    Only the export directory is parsed.
     """
-    logging.info("Generating DEF file...")
+    pe = pefile.PE(str(dll), fast_load=True)
     try:
-        # Use EXPORT_DLL.name so that we pass "go_lib.dll" instead of the full path.
-        result = run_command(
-            ["dumpbin", "/exports", EXPORT_DLL.name],
-            cwd=str(FFI_DIR),
-            capture_output=True,
+        pe.parse_data_directories(
+            directories=[pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_EXPORT"]]
         )
-    except subprocess.CalledProcessError as e:
-        logging.error("dumpbin failed: %s", e)
+        export_dir = getattr(pe, "DIRECTORY_ENTRY_EXPORT", None)
+        if export_dir is None:
+            return []
+        return [sym.name.decode("ascii") for sym in export_dir.symbols if sym.name]
+    finally:
+        pe.close()
+
+
+def write_def_exports(f, exports: Iterable[str]) -> None:
+    """
+    Write the DEF header and one export name per line to an open file.
+    """
+    try:
+        f.write("EXPORTS\n")
+        f.writelines(name + "\n" for name in exports)
+    except UnicodeDecodeError as e:
+        log.error("DLL export name is not ASCII: %s", e)
+        sys.exit(1)
+    except IOError as e:
+        log.error("Failed to write DEF file: %s", e)
         sys.exit(1)
 
-    def_content = generate_def_content(result.stdout)
+
+def write_dumpbin_exports(f) -> None:
+    """
+    Run dumpbin on the DLL and stream its export names into an open DEF file.
+    dumpbin's stdout is parsed line by line while it runs instead of being
+    buffered in full first, and the process is always waited on, even when
+    writing fails.
+    Note: Since we're running in FFI_DIR, we pass only the DLL's name.
+    """
+    # Use EXPORT_DLL.name so that we pass "go_lib.dll" instead of the full path.
+    cmd = (tool("dumpbin"), "/exports", EXPORT_DLL.name)
+    log_command(cmd)
     try:
-        with EXPORT_DEF.open("w", encoding="utf-8") as f:
-            f.write(def_content)
-        logging.info("DEF file generated: %s", EXPORT_DEF)
+        proc = subprocess.Popen(cmd, cwd=FFI_DIR, stdout=subprocess.PIPE)
+    except OSError as e:
+        log.error("Failed to run dumpbin: %s", e)
+        sys.exit(1)
+    with proc:
+        write_def_exports(f, parse_dumpbin_exports(proc.stdout))
+    if proc.returncode:
+        log.error("dumpbin failed with exit status %d", proc.returncode)
+        sys.exit(1)
+
+
+def generate_def():
+    """
+    Generate a DEF file from the DLL exports.
+    The exports are read in-process with pefile when it is installed,
+    otherwise dumpbin is used. Names are streamed into a sibling temp file
+    which is then swapped in, so an interrupted build never leaves a
+    truncated DEF behind with a fresh mtime.
+    """
+    log.info("Generating DEF file...")
+    if pefile is not None:
+        try:
+            exports = read_exports_pefile(EXPORT_DLL)
+        except (OSError, pefile.PEFormatError, UnicodeDecodeError) as e:
+            log.error("Failed to read DLL exports: %s", e)
+            sys.exit(1)
+
+    # The temp file is opened before dumpbin is spawned, so no failure can
+    # leave the child running. It is removed on every path that does not
+    # swap it in.
+    tmp_def = EXPORT_DEF.with_suffix(".def.tmp")
+    try:
+        f = tmp_def.open("w", encoding="utf-8", buffering=1 << 16, newline="\n")
+    except IOError as e:
+        log.error("Failed to write DEF file: %s", e)
+        sys.exit(1)
+    try:
+        with f:
+            if pefile is not None:
+                write_def_exports(f, exports)
+            else:
+                write_dumpbin_exports(f)
+        os.replace(tmp_def, EXPORT_DEF)
     except IOError as e:
-        logging.error("Failed to write DEF file: %s", e)
+        log.error("Failed to write DEF file: %s", e)
         sys.exit(1)
+    finally:
+        tmp_def.unlink(missing_ok=True)
+    log.info("DEF file generated: %s", EXPORT_DEF)
 
 
 def generate_lib():
@@ -165,130 +329,195 @@ def generate_lib():
     Generate an import library (.lib) from the DEF file using dlltool.
     To avoid path component issues, this command is executed from FFI_DIR.
     """
-    logging.info("Generating import library (.lib) using dlltool...")
+    log.info("Generating import library (.lib) using dlltool...")
     try:
         run_command(
-            [
-                "dlltool",
+            (
+                tool("dlltool"),
                 "-d",
                 EXPORT_DEF.name,
                 "-D",
                 EXPORT_DLL.name,
                 "-l",
                 EXPORT_LIB.name,
-            ],
-            cwd=str(FFI_DIR),
+            ),
+            cwd=FFI_DIR,
         )
     except subprocess.CalledProcessError as e:
-        logging.error("dlltool failed: %s", e)
+        log.error("dlltool failed: %s", e)
         sys.exit(1)
-    logging.info("Import library generated: %s", EXPORT_LIB)
+    log.info("Import library generated: %s", EXPORT_LIB)
 
 
-def copy_with_retry(src: Path, dst: Path, retries: int) -> None:
+def fast_copy(src: Path, dst: Path) -> None:
     """
-    Attempt to copy a file from src to dst with a simple retry mechanism.
+    Place the contents of src at dst as cheaply as the platform allows.
+    A hard link is tried first, and a dst that is already a link to src is
+    left untouched; if linking fails (different volume, or a filesystem
+    without link support) the file is copied kernel-side via CopyFileW on
+    Windows or shutil.copyfile elsewhere. Metadata is not preserved since
+    the DLL is a build artifact.
     """
-    for attempt in range(1, retries + 1):
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        if os.path.samefile(src, dst):
+            return
+        dst.unlink()
         try:
-            shutil.copy2(str(src), str(dst))
+            os.link(src, dst)
             return
-        except Exception as e:
-            if attempt < retries:
-                logging.warning(
-                    "Failed to copy %s to %s (attempt %d/%d). Retrying...",
-                    src,
-                    dst,
-                    attempt,
-                    retries,
-                )
-                time.sleep(0.1 * attempt)
-            else:
-                logging.error(
-                    "Failed to copy %s to %s after %d attempts: %s",
-                    src,
-                    dst,
-                    retries,
-                    e,
-                )
-                raise e
+        except OSError:
+            pass
+    except OSError:
+        pass
+
+    if sys.platform == "win32":
+        if not _kernel32.CopyFileW(str(src), str(dst), False):
+            raise ctypes.WinError(ctypes.get_last_error())
+    else:
+        shutil.copyfile(src, dst)
 
 
-def copy_dll():
+def copy_with_retry(src: Path, dst: Path, retries: int) -> None:
     """
-    Copy the generated DLL to the primary target directory.
+    Attempt to copy a file from src to dst, retrying with exponential backoff
+    only while Windows reports the file as locked by another process.
+    Any other error, or the last locked attempt, is raised for the caller
+    to report.
     """
-    logging.info("Copying DLL to target directory: %s", TARGET_DIR)
-    TARGET_DIR.mkdir(parents=True, exist_ok=True)
-    try:
-        shutil.copy2(str(EXPORT_DLL), str(TARGET_DLL))
-    except Exception as e:
-        logging.error("Failed to copy DLL: %s", e)
-        sys.exit(1)
-    logging.info("DLL copied to: %s", TARGET_DLL)
-
-
-def copy_dll_to_test_dir():
+    for attempt in range(1, retries + 1):
+        try:
+            fast_copy(src, dst)
+            return
+        except OSError as e:
+            if getattr(e, "winerror", None) not in _SHARING_ERRORS:
+                raise
+            if attempt == retries:
+                raise
+            log.warning(
+                "Failed to copy %s to %s (attempt %d/%d). Retrying...",
+                src,
+                dst,
+                attempt,
+                retries,
+            )
+            time.sleep(min(0.01 * (2**attempt), 0.2))
+
+
+def distribute_dll(force: bool = False):
     """
-    Copy the DLL to additional test directories.
-    This mimics the Rust function that copies the DLL to both
-    'target/debug/deps' and 'target/debug'.
+    Copy the DLL to the primary target directory and the test directories.
+    Destinations are deduplicated by resolved path (TARGET_DIR is also one
+    of the TEST_DIRS), so each file is written once and no two workers write
+    the same file. The copies are independent, so they run concurrently.
+    Destinations already up to date with the DLL are skipped unless force is set.
     """
-    for test_dir in TEST_DIRS:
-        test_dir.mkdir(parents=True, exist_ok=True)
-        target_dll = test_dir / f"{EXPORT_NAME}.dll"
+    targets = dict.fromkeys(
+        d.resolve() / f"{EXPORT_NAME}.dll" for d in [TARGET_DIR, *TEST_DIRS]
+    )
+    dsts = [dst for dst in targets if force or needs_rebuild(dst, EXPORT_DLL)]
+    if not dsts:
+        log.info("DLL copies are up to date.")
+        return
+    for parent in dict.fromkeys(dst.parent for dst in dsts):
+        parent.mkdir(parents=True, exist_ok=True)
+
+    log.info("Copying DLL to %d destinations...", len(dsts))
+    with ThreadPoolExecutor(max_workers=len(dsts)) as ex:
+        futures = {
+            dst: ex.submit(copy_with_retry, EXPORT_DLL, dst, retries=5) for dst in dsts
+        }
+    failed = False
+    for dst, future in futures.items():
         try:
-            copy_with_retry(EXPORT_DLL, target_dll, retries=5)
-        except Exception as e:
-            logging.error("Failed to copy DLL to test directory %s: %s", test_dir, e)
-            sys.exit(1)
-        logging.info("Copied DLL to test directory: %s", target_dll)
+            future.result()
+        except OSError as e:
+            log.error("Failed to copy DLL to %s: %s", dst, e)
+            failed = True
+        else:
+            log.info("DLL copied to: %s", dst)
+    if failed:
+        sys.exit(1)
 
 
 def cargo_build():
     """
     Build the Rust project with Cargo.
     """
-    logging.info("Building Rust project with Cargo...")
+    log.info("Building Rust project with Cargo...")
     try:
-        run_command(["cargo", "build"], capture_output=False)
+        run_command((tool("cargo"), "build"), capture_output=False)
     except subprocess.CalledProcessError as e:
-        logging.error("Cargo build failed: %s", e)
+        log.error("Cargo build failed: %s", e)
         sys.exit(1)
-    logging.info("Rust project built successfully.")
+    log.info("Rust project built successfully.")
 
 
 def clean():
     """
     Remove generated files and run cargo clean.
     """
-    logging.info("Cleaning up generated files...")
-    for path in [EXPORT_DLL, EXPORT_DEF, EXPORT_LIB]:
-        if path.exists():
+    log.info("Cleaning up generated files...")
+    # One directory scan also catches leftovers from interrupted builds,
+    # such as the temporary DEF file.
+    for path in FFI_DIR.glob(f"{EXPORT_NAME}.*"):
+        if path.suffix in GENERATED_SUFFIXES:
             try:
-                path.unlink()
-                logging.info("Deleted: %s", path)
+                path.unlink(missing_ok=True)
+                log.info("Deleted: %s", path)
             except Exception as e:
-                logging.warning("Could not delete %s: %s", path, e)
-    logging.info("Running 'cargo clean'...")
+                log.warning("Could not delete %s: %s", path, e)
+    log.info("Running 'cargo clean'...")
     try:
-        run_command(["cargo", "clean"])
+        run_command((tool("cargo"), "clean"))
     except subprocess.CalledProcessError as e:
-        logging.error("cargo clean failed: %s", e)
+        log.error("cargo clean failed: %s", e)
         sys.exit(1)
 
 
-def build_all():
+def build_import_lib(force: bool = False):
+    """
+    Generate the DEF file and then the import library, skipping whichever
+    is already up to date unless force is set.
+    """
+    if force or needs_rebuild(EXPORT_DEF, EXPORT_DLL):
+        generate_def()
+    else:
+        log.info("DEF file is up to date: %s", EXPORT_DEF)
+    if force or needs_rebuild(EXPORT_LIB, EXPORT_DEF, EXPORT_DLL):
+        generate_lib()
+    else:
+        log.info("Import library is up to date: %s", EXPORT_LIB)
+
+
+def build_all(force: bool = False):
     """
     Execute the entire build process.
+    Steps whose outputs are newer than their inputs are skipped unless
+    force is set. Once the DLL exists, the DEF/LIB generation and the DLL
+    distribution only read it, so the two run concurrently.
     """
     ensure_dirs()
     go_mod_init()
-    go_build()
-    generate_def()
-    generate_lib()
-    copy_dll()
-    copy_dll_to_test_dir()  # New: Copy DLL to test directories.
+    # go build also emits the header that build.rs feeds to bindgen.
+    go_deps = (EXPORT_GO, FFI_DIR / "go.mod")
+    if (
+        force
+        or needs_rebuild(EXPORT_DLL, *go_deps)
+        or needs_rebuild(EXPORT_HEADER, *go_deps)
+    ):
+        go_build()
+    else:
+        log.info("DLL is up to date: %s", EXPORT_DLL)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [
+            ex.submit(build_import_lib, force),
+            ex.submit(distribute_dll, force),
+        ]
+    for future in futures:
+        future.result()
     # cargo_build()
 
 
@@ -304,15 +533,28 @@ def parse_args():
         action="store_true",
         help="Clean generated artifacts and cargo build artifacts.",
     )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild every target even if it appears up to date.",
+    )
     return parser.parse_args()
 
 
 def main():
+    # Only configure logging when nothing else has, so a parent driver that
+    # imports this module keeps control of the root logger.
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format="[%(asctime)s] %(levelname)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
     args = parse_args()
     if args.clean:
         clean()
     else:
-        build_all()
+        build_all(force=args.force)
 
 
 if __name__ == "__main__":